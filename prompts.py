@@ -1,22 +1,33 @@
+import asyncio
+import calendar
+import hashlib
+import itertools
+import json
 import logging
 import os
+import threading
 from datetime import date, datetime
-from typing import Callable, List
-
-import langchain
-from dateutil import parser as dateparser
-from dateutil.relativedelta import relativedelta
-from langchain import LLMChain
-from langchain.cache import InMemoryCache
-from langchain.chains.openai_functions import create_structured_output_chain
-from langchain.chat_models import ChatOpenAI
-from langchain.output_parsers import PydanticOutputParser
-from langchain.prompts import ChatPromptTemplate, HumanMessagePromptTemplate
-from langchain.schema import HumanMessage, SystemMessage
+from functools import cached_property, lru_cache
+from typing import TYPE_CHECKING, Annotated, AsyncIterator, Callable, List, Literal
+from uuid import uuid4
+
+import msgspec
+from langchain.chains import LLMChain
+from langchain.globals import get_llm_cache, set_llm_cache
+from langchain_community.chat_models import ChatOpenAI
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langchain_core.outputs import ChatGeneration
+from langchain_core.prompts import ChatPromptTemplate, HumanMessagePromptTemplate
 from pydantic import BaseModel, Field
 
 import utils
 
+# heavy clients are imported on first use
+if TYPE_CHECKING:
+    import httpx
+    import openai
+    from diskcache import Cache
+
 # create logger
 logger = logging.getLogger(__name__)
 
@@ -28,19 +39,368 @@ if "OPENAI_API_KEY" not in os.environ:
     prompt = "Enter your OpenAI API key:"
     os.environ["OPENAI_API_KEY"] = input(prompt)
 
-# Set up LLM cache
-langchain.llm_cache = InMemoryCache()
+
+# bump to invalidate all cached responses, e.g. after changing how responses are parsed.
+# covers the response cache and the sqlite llm cache, but not a shared redis llm cache
+CACHE_VERSION = 1
+
+
+def get_cache_dir() -> str:
+    """Directory of the caches that persist across runs: `AI_RESUME_CACHE_DIR`, `~/.ai_resume_cache` by default"""
+    cache_dir = os.environ.get("AI_RESUME_CACHE_DIR") or "~/.ai_resume_cache"
+    return os.path.expanduser(cache_dir)
+
+
+@lru_cache(maxsize=None)
+def get_response_cache() -> "Cache":
+    """Cache of structured LLM responses that persists across runs, opened on first use"""
+    from diskcache import Cache
+
+    return Cache(get_cache_dir())
+
+
+def create_llm_cache():
+    """Create the LLM cache set by `AI_RESUME_CACHE_BACKEND`: `sqlite` (default), `memory` or `redis`"""
+    backend = os.environ.get("AI_RESUME_CACHE_BACKEND") or "sqlite"
+    if backend == "memory":
+        from langchain_community.cache import InMemoryCache
+
+        return InMemoryCache()
+    if backend == "sqlite":
+        from langchain_community.cache import SQLiteCache
+
+        # persists across runs, in a new database for each cache version
+        os.makedirs(get_cache_dir(), exist_ok=True)
+        return SQLiteCache(
+            database_path=os.path.join(
+                get_cache_dir(), f"llm_cache_v{CACHE_VERSION}.db"
+            )
+        )
+    if backend == "redis":
+        from langchain_community.cache import RedisCache
+
+        # redis is an optional dependency, only needed for this backend
+        try:
+            from redis import Redis
+        except ImportError:
+            message = "AI_RESUME_CACHE_BACKEND `redis` needs the redis package. Install it with `pip install redis`."
+            logger.error(message)
+            raise
+
+        return RedisCache(
+            redis_=Redis.from_url(
+                os.environ.get("REDIS_URL") or "redis://localhost:6379"
+            )
+        )
+    message = f"Unknown AI_RESUME_CACHE_BACKEND `{backend}`. Use one of: sqlite, memory, redis."
+    logger.error(message)
+    raise ValueError(message)
 
 
 def create_llm(**kwargs):
+    # Set up LLM cache on first use rather than at import
+    if get_llm_cache() is None:
+        set_llm_cache(create_llm_cache())
+
     # set LLM provider
     chat_model = kwargs.pop("chat_model", ChatOpenAI)
     # set default model
     if "model_name" not in kwargs:
-        kwargs["model_name"] = "gpt-3.5-turbo"
+        kwargs["model_name"] = "gpt-4o-mini"
     return chat_model(**kwargs)
 
 
+def create_http_client(proxy: str = None) -> "httpx.AsyncClient":
+    """Async HTTP/2 client with a keepalive pool sized for concurrent llm calls"""
+    import httpx
+
+    return httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=32, max_keepalive_connections=32),
+        proxy=proxy or None,
+    )
+
+
+# prefixes of the OpenAI models that support strict json_schema structured outputs
+_STRUCTURED_OUTPUT_MODELS = ("gpt-4o", "gpt-4.1", "gpt-5", "o3", "o4")
+
+
+def supports_structured_outputs(llm) -> bool:
+    """Whether the replies of the llm can be constrained to a json_schema by direct OpenAI calls"""
+    model_name = getattr(llm, "model_name", None) or ""
+    return (
+        getattr(llm, "_llm_type", None) == "openai-chat"
+        and model_name.startswith(_STRUCTURED_OUTPUT_MODELS)
+        # the first gpt-4o snapshot predates structured outputs
+        and model_name != "gpt-4o-2024-05-13"
+    )
+
+
+def openai_client_params(llm) -> dict:
+    """Settings of a ChatOpenAI llm for the OpenAI clients that are used without langchain"""
+    if getattr(llm, "_llm_type", None) != "openai-chat":
+        message = f"Direct OpenAI calls need a ChatOpenAI llm, but `chat_model` is `{type(llm).__name__}`."
+        logger.error(message)
+        raise ValueError(message)
+    api_key = getattr(llm, "openai_api_key", None)
+    if hasattr(api_key, "get_secret_value"):
+        api_key = api_key.get_secret_value()
+    params = dict(
+        api_key=api_key or None,
+        organization=getattr(llm, "openai_organization", None) or None,
+        base_url=getattr(llm, "openai_api_base", None) or None,
+        default_headers=getattr(llm, "default_headers", None),
+    )
+    # keep the OpenAI defaults for settings the llm leaves unset
+    if getattr(llm, "request_timeout", None) is not None:
+        params["timeout"] = llm.request_timeout
+    if getattr(llm, "max_retries", None) is not None:
+        params["max_retries"] = llm.max_retries
+    return params
+
+
+@lru_cache(maxsize=None)
+def _background_loop() -> asyncio.AbstractEventLoop:
+    """Event loop that runs forever in a daemon thread, started on first use"""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="run_sync", daemon=True).start()
+    return loop
+
+
+def run_sync(coro):
+    """Run a coroutine to completion from synchronous code, even if an event loop is already running (e.g. in Jupyter).
+    All coroutines run on one long-lived background loop, so async clients and their pooled connections
+    can be reused across calls. A new loop per call would leave them bound to a closed loop.
+    """
+    loop = _background_loop()
+    try:
+        running_loop = asyncio.get_running_loop()
+    except RuntimeError:
+        running_loop = None
+    if running_loop is loop:
+        # waiting on the loop from within itself would never return
+        coro.close()
+        raise RuntimeError(
+            "run_sync cannot be called from a coroutine, await it instead."
+        )
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+
+def _response_cache_key(prompt: str, schema: dict, llm) -> str:
+    """Content hash of everything that determines a response, so unchanged inputs are never sent twice"""
+    key = dict(
+        version=CACHE_VERSION,
+        prompt=prompt,
+        schema=schema,
+        model=getattr(llm, "model_name", None),
+        temperature=getattr(llm, "temperature", None),
+    )
+    return hashlib.blake2b(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def _chain_cache_key(chain: LLMChain, schema: type[BaseModel], inputs: dict) -> str:
+    return _response_cache_key(
+        chain.prompt.format(**inputs), schema.model_json_schema(), chain.llm
+    )
+
+
+def cached_predict(chain: LLMChain, schema: type[BaseModel], **inputs) -> BaseModel:
+    """Predict with a structured output chain, caching the response by prompt, schema and model"""
+    key = _chain_cache_key(chain, schema, inputs)
+    cached = get_response_cache().get(key)
+    if cached is not None:
+        return schema.model_validate_json(cached)
+    result = chain.predict(**inputs)
+    get_response_cache().set(key, result.model_dump_json())
+    return result
+
+
+async def acached_predict(
+    chain: LLMChain, schema: type[BaseModel], **inputs
+) -> BaseModel:
+    """Async version of `cached_predict`"""
+    key = _chain_cache_key(chain, schema, inputs)
+    cached = get_response_cache().get(key)
+    if cached is not None:
+        return schema.model_validate_json(cached)
+    result = await chain.apredict(**inputs)
+    get_response_cache().set(key, result.model_dump_json())
+    return result
+
+
+def prompt_cache_key(prompt: ChatPromptTemplate) -> str:
+    """Identifies the static prefix of a prompt for OpenAI prompt cache routing.
+    Prompts keep all inputs in their last message, so all preceding messages are the static prefix.
+    """
+    static_prefix = "\n".join(m.content for m in prompt.messages[:-1])
+    return hashlib.sha256(static_prefix.encode()).hexdigest()[:32]
+
+
+def create_structured_chain(
+    schema: dict | type[BaseModel], llm, prompt: ChatPromptTemplate, **chain_kwargs
+) -> LLMChain:
+    """Structured output chain whose requests are routed to the OpenAI prompt cache of its static prefix"""
+    from langchain.chains.openai_functions import create_structured_output_chain
+
+    chain = create_structured_output_chain(schema, llm, prompt, **chain_kwargs)
+    # other chat models don't accept OpenAI request fields
+    if getattr(llm, "_llm_type", None) == "openai-chat":
+        chain.llm_kwargs["extra_body"] = {"prompt_cache_key": prompt_cache_key(prompt)}
+    return chain
+
+
+def _message_to_openai(message) -> dict:
+    roles = {"system": "system", "human": "user", "ai": "assistant"}
+    return {"role": roles[message.type], "content": message.content}
+
+
+class Openai_Batch:
+    """Structured output chain requests submitted together to the OpenAI Batch API.
+    Batches cost half as much as real-time requests, but may take up to 24 hours to complete.
+    Requests already answered in the response cache are not submitted.
+    Await the batch to get the outputs, optionally combined by `postprocess`."""
+
+    FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+    def __init__(
+        self,
+        requests: list[tuple[LLMChain, type[BaseModel], dict]],
+        postprocess: Callable = None,
+        poll_interval: float = 60.0,
+    ):
+        import httpx
+        import openai
+
+        self.postprocess = postprocess
+        self.poll_interval = poll_interval
+        self.batch = None
+
+        self.requests = {uuid4().hex: request for request in requests}
+        self.outputs = {}
+        lines = []
+        for custom_id, (chain, schema, inputs) in self.requests.items():
+            cached = get_response_cache().get(_chain_cache_key(chain, schema, inputs))
+            if cached is not None:
+                self.outputs[custom_id] = schema.model_validate_json(cached)
+                continue
+            messages = chain.prompt.format_messages(**inputs)
+            # function definitions of the structured output chain,
+            # with any extra body fields sent at the top level of the request
+            llm_kwargs = dict(chain.llm_kwargs)
+            llm_kwargs |= llm_kwargs.pop("extra_body", {})
+            body = dict(
+                model=chain.llm.model_name,
+                temperature=chain.llm.temperature,
+                messages=[_message_to_openai(m) for m in messages],
+                **llm_kwargs,
+            )
+            lines.append(
+                json.dumps(
+                    dict(
+                        custom_id=custom_id,
+                        method="POST",
+                        url="/v1/chat/completions",
+                        body=body,
+                    )
+                )
+            )
+        if not lines:
+            logger.info(
+                f"All {len(self.requests)} requests were answered from the response cache, so no batch was submitted."
+            )
+            return
+
+        # all requests are sent with the settings of the first chain's llm
+        proxy = getattr(requests[0][0].llm, "openai_proxy", None)
+        self.client = openai.OpenAI(
+            **openai_client_params(requests[0][0].llm),
+            http_client=httpx.Client(proxy=proxy) if proxy else None,
+        )
+        batch_file = self.client.files.create(
+            file=("batch.jsonl", "\n".join(lines).encode()), purpose="batch"
+        )
+        self.batch = self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        logger.info(f"Submitted batch `{self.batch.id}` with {len(lines)} requests.")
+
+    async def wait(self):
+        """Poll the batch until it is done, and return the parsed outputs in the order of the requests"""
+        if self.batch is not None:
+            await self._wait_for_batch()
+        outputs = [self.outputs[custom_id] for custom_id in self.requests]
+        if self.postprocess:
+            return self.postprocess(*outputs)
+        return outputs
+
+    async def _wait_for_batch(self):
+        """Poll the submitted batch until it is done, and store its parsed outputs"""
+        while self.batch.status not in self.FINAL_STATUSES:
+            await asyncio.sleep(self.poll_interval)
+            self.batch = await asyncio.to_thread(
+                self.client.batches.retrieve, self.batch.id
+            )
+        if self.batch.status != "completed" or not self.batch.output_file_id:
+            message = (
+                f"Batch `{self.batch.id}` ended with status `{self.batch.status}`."
+            )
+            logger.error(message)
+            raise RuntimeError(message)
+
+        content = await asyncio.to_thread(
+            self.client.files.content, self.batch.output_file_id
+        )
+        for line in content.text.splitlines():
+            response = json.loads(line)
+            chain, schema, inputs = self.requests[response["custom_id"]]
+            message = response["response"]["body"]["choices"][0]["message"]
+            generation = ChatGeneration(
+                message=AIMessage(
+                    content=message.get("content") or "",
+                    additional_kwargs={"function_call": message["function_call"]},
+                )
+            )
+            output = chain.output_parser.parse_result([generation])
+            # store in the response cache, so the same request is not repeated
+            get_response_cache().set(
+                _chain_cache_key(chain, schema, inputs), output.model_dump_json()
+            )
+            self.outputs[response["custom_id"]] = output
+
+        missing = len(self.requests) - len(self.outputs)
+        if missing:
+            message = (
+                f"Batch `{self.batch.id}` is missing outputs for {missing} requests."
+            )
+            logger.error(message)
+            raise RuntimeError(message)
+
+    def __await__(self):
+        return self.wait().__await__()
+
+
+def _object_json_schema(schema_cls: type[msgspec.Struct]) -> dict:
+    """JSON schema of the msgspec class, with an object at its root"""
+    schema = msgspec.json.schema(schema_cls)
+    # the root of the schema must be an object, not a reference to one
+    definitions = schema.pop("$defs")
+    schema = definitions.pop(schema_cls.__name__)
+    if definitions:
+        schema["$defs"] = definitions
+    return schema
+
+
+def _json_schema_response_format(schema_cls: type[msgspec.Struct]) -> dict:
+    """OpenAI structured outputs response format that constrains the reply to the msgspec class"""
+    schema = _object_json_schema(schema_cls)
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": schema_cls.__name__, "schema": schema, "strict": True},
+    }
+
+
 def format_list_as_string(l: list) -> str:
     if isinstance(l, list):
         return "\n".join(l)
@@ -49,26 +409,48 @@ def format_list_as_string(l: list) -> str:
 
 def format_prompt_inputs_as_strings(prompt_inputs: list[str], **kwargs):
     """Convert values to string for all keys in kwargs matching list in prompt inputs"""
+    prompt_inputs = set(prompt_inputs)
     return {
-        k: format_list_as_string(v) for k, v in kwargs.items() if k in prompt_inputs
+        k: v if isinstance(v, str) else format_list_as_string(v)
+        for k, v in kwargs.items()
+        if k in prompt_inputs
     }
 
 
+# Date formats tried with `datetime.strptime` before falling back to dateutil.
+# Every format includes the year, so missing month/day default to 1 as in dateutil.
+_FAST_FORMATS = ("%Y-%m-%d", "%Y/%m/%d", "%Y-%m", "%m/%Y", "%Y")
+
+
+@lru_cache(maxsize=2048)
 def parse_date(d: str) -> datetime:
     """Given an arbitrary string, parse it to a date"""
+    d = str(d).strip()
+    for fmt in _FAST_FORMATS:
+        try:
+            return datetime.strptime(d, fmt)
+        except ValueError:
+            pass
+    # dateutil is slow to import, and only needed for uncommon formats
+    from dateutil import parser as dateparser
+
     # set default date to January 1 of current year
     default_date = datetime(date.today().year, 1, 1)
     try:
-        return dateparser.parse(str(d), default=default_date)
+        return dateparser.parse(d, default=default_date)
     except dateparser._parser.ParserError as e:
         logger.error(f"Date input `{d}` could not be parsed.")
         raise e
 
 
-def datediff_years(start_date: str, end_date: str) -> float:
-    """Get difference between arbitrarily formatted dates in fractional years to the floor month"""
-    datediff = relativedelta(parse_date(end_date), parse_date(start_date))
-    return datediff.years * 1.0 + datediff.months / 12.0
+def _complete_months(start: datetime, end: datetime) -> int:
+    """Number of complete months from start to end, as counted by relativedelta"""
+    months = (end.year - start.year) * 12 + (end.month - start.month)
+    # a start day past the end of the end month is clamped to the last day of that month
+    day = min(start.day, calendar.monthrange(end.year, end.month)[1])
+    if end < start.replace(year=end.year, month=end.month, day=day):
+        months -= 1
+    return months
 
 
 # Pydantic class that defines the format to be returned by the LLM
@@ -121,15 +503,59 @@ class Job_Skills(BaseModel):
     )
 
 
-# Pydantic class that defines each item to be returned by the LLM
-class Resume_Item(BaseModel):
-    item: str = Field(..., description="Represents one bullet point")
-    relevance: int = Field(..., enum=[1, 2, 3, 4, 5])
-
-
-# Pydantic class that defines a list of bullet items to be returned by the LLM
-class Resume_List(BaseModel):
-    items: List[Resume_Item] = Field(..., description="A list of bullet points")
+# msgspec class that defines each item to be returned by the LLM.
+# Section rewrites are requested directly from OpenAI and decoded by msgspec without pydantic.
+class Resume_Item(msgspec.Struct, forbid_unknown_fields=True):
+    item: Annotated[str, msgspec.Meta(description="Represents one bullet point")]
+    relevance: Literal[1, 2, 3, 4, 5]
+
+
+# msgspec class that defines a list of bullet items to be returned by the LLM
+class Resume_List(msgspec.Struct, forbid_unknown_fields=True):
+    items: Annotated[
+        List[Resume_Item], msgspec.Meta(description="A list of bullet points")
+    ]
+
+
+# msgspec class that defines lists of bullet items for several sections to be returned by the LLM
+class Resume_Sections(msgspec.Struct, forbid_unknown_fields=True):
+    sections: Annotated[
+        List[Resume_List],
+        msgspec.Meta(
+            description="One list of bullet points for each section, in the same order as the sections"
+        ),
+    ]
+
+
+# msgspec class that defines all generated sections of a resume to be returned by the LLM in one response
+class Full_Resume(msgspec.Struct, forbid_unknown_fields=True):
+    experiences: Annotated[
+        List[Resume_List],
+        msgspec.Meta(
+            description="One list of bullet points for each numbered work experience, in the same order as the work experiences"
+        ),
+    ]
+    projects: Annotated[
+        Resume_List, msgspec.Meta(description="A list of bullet points for my projects")
+    ]
+    software_skills: Annotated[
+        List[str],
+        msgspec.Meta(
+            description="An itemized list of technical skills like programming languages and tools"
+        ),
+    ]
+    soft_skills: Annotated[
+        List[str],
+        msgspec.Meta(
+            description="An itemized list of non-technical Soft skills. Some examples of soft skills are: communication, leadership, adaptability, teamwork, problem solving, critical thinking, time management"
+        ),
+    ]
+    summary: Annotated[
+        str,
+        msgspec.Meta(
+            description="Summary of the resume as it relates to the job posting"
+        ),
+    ]
 
 
 # Pydantic class that defines a list of improvements to be returned by the LLM
@@ -151,8 +577,8 @@ class Language_Fix(BaseModel):
     fix: str = Field(..., description="Suggestion to fix the error")
 
 
-# Pydantic class that defines a list of errors and improvements to be returned by the LLM
-class Language_Improvements(BaseModel):
+# Pydantic class that defines improvements and language errors to be returned by the LLM in one response
+class Resume_Improvements_Plus_Language(Resume_Improvements):
     fixes: List[Language_Fix] = Field(
         ..., description="List of language errors and their fixes"
     )
@@ -181,10 +607,29 @@ class Job_Post:
     def __init__(self, posting: str, **llm_kwargs):
         self.posting = posting
         self.llm_kwargs = llm_kwargs
+        # a single llm shared by all chains reuses its client and connection pool
+        self.llm = create_llm(**llm_kwargs)
 
         self.parsed_job = None
 
-    def _parser_chain(self, **chain_kwargs) -> LLMChain:
+    @property
+    def parsed_job(self) -> dict:
+        return self._parsed_job
+
+    @parsed_job.setter
+    def parsed_job(self, parsed_job: dict):
+        self._parsed_job = parsed_job
+        self.__dict__.pop("parsed_job_strings", None)
+
+    @cached_property
+    def parsed_job_strings(self) -> dict:
+        """The parsed job formatted for prompts once, so downstream chains don't have to"""
+        return format_prompt_inputs_as_strings(
+            prompt_inputs=self.parsed_job, **self.parsed_job
+        )
+
+    @cached_property
+    def _parser_prompt(self) -> ChatPromptTemplate:
         prompt_msgs = [
             SystemMessage(
                 content="You are a world class algorithm for extracting information in structured formats."
@@ -192,19 +637,20 @@ class Job_Post:
             HumanMessage(
                 content="Use the given format to extract information from the following input:"
             ),
-            HumanMessagePromptTemplate.from_template("{input}"),
-            HumanMessage(
-                content="Tips: Make sure to answer in the correct format and stick to any word or item limits."
+            HumanMessagePromptTemplate.from_template(
+                "{input}"
+                "\nTips: Make sure to answer in the correct format and stick to any word or item limits."
             ),
         ]
-        prompt = ChatPromptTemplate(messages=prompt_msgs)
+        return ChatPromptTemplate(messages=prompt_msgs)
 
-        llm = create_llm(**self.llm_kwargs)
-        return create_structured_output_chain(
-            Job_Description, llm, prompt, **chain_kwargs
+    def _parser_chain(self, **chain_kwargs) -> LLMChain:
+        return create_structured_chain(
+            Job_Description, self.llm, self._parser_prompt, **chain_kwargs
         )
 
-    def _skills_extractor_chain(self, **chain_kwargs) -> LLMChain:
+    @cached_property
+    def _skills_extractor_prompt(self) -> ChatPromptTemplate:
         prompt_msgs = [
             SystemMessage(
                 content="You are a world class algorithm for extracting information in structured formats."
@@ -216,21 +662,25 @@ class Job_Post:
                 "Job Posting:\n"
                 "\nThe ideal candidate is able to perform the following duties:\n{duties}\n"
                 "\nThe ideal candidate has the following experience and skills:\n{skill_and_experience_requirements}"
-            ),
-            HumanMessage(
-                content="Tips: Make sure to answer in the correct format and stick to any word or item limits."
+                "\nTips: Make sure to answer in the correct format and stick to any word or item limits."
             ),
         ]
-        prompt = ChatPromptTemplate(messages=prompt_msgs)
+        return ChatPromptTemplate(messages=prompt_msgs)
 
-        llm = create_llm(**self.llm_kwargs)
-        return create_structured_output_chain(Job_Skills, llm, prompt, **chain_kwargs)
+    def _skills_extractor_chain(self, **chain_kwargs) -> LLMChain:
+        return create_structured_chain(
+            Job_Skills, self.llm, self._skills_extractor_prompt, **chain_kwargs
+        )
 
     def parse_job_post(self, **chain_kwargs) -> dict:
-        parsed_job = self._parser_chain(**chain_kwargs).predict(input=self.posting)
-        parsed_job = parsed_job.dict()
-        job_skills = self._skills_extractor_chain(**chain_kwargs).predict(**parsed_job)
-        self.parsed_job = parsed_job | job_skills.dict()
+        parsed_job = cached_predict(
+            self._parser_chain(**chain_kwargs), Job_Description, input=self.posting
+        )
+        parsed_job = parsed_job.model_dump()
+        job_skills = cached_predict(
+            self._skills_extractor_chain(**chain_kwargs), Job_Skills, **parsed_job
+        )
+        self.parsed_job = parsed_job | job_skills.model_dump()
         return self.parsed_job
 
 
@@ -243,10 +693,18 @@ class Resume_Builder:
     ):
         # Constants
         self.MAX_SECTION_ITEMS = 7
+        # number of sections rewritten together in one llm call
+        self.BATCH_ROWS = 4
 
         self.raw = raw_resume
         self.job_post = job_post
         self.llm_kwargs = llm_kwargs
+        # a single llm shared by all chains reuses its client and connection pool
+        self.llm = create_llm(**llm_kwargs)
+        # ChatOpenAI takes a single http_client for both its sync and async clients,
+        # so its async client is replaced to share the pool of the direct OpenAI client
+        if getattr(self.llm, "_llm_type", None) == "openai-chat":
+            self.llm.async_client = self.openai_client.chat.completions
 
         # parse job post if not already
         if not self.job_post.parsed_job:
@@ -266,7 +724,77 @@ class Resume_Builder:
         self.skills = None
         self.summary = None
 
-    def _section_rewriter_chain(self, **chain_kwargs) -> LLMChain:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    @cached_property
+    def http_client(self) -> "httpx.AsyncClient":
+        """Pool that multiplexes concurrent llm calls over HTTP/2 connections.
+        Connections are bound to one event loop, so await the async methods from a single loop,
+        or use the sync wrappers, which all run on the loop of `run_sync`."""
+        return create_http_client(getattr(self.llm, "openai_proxy", None))
+
+    @cached_property
+    def openai_client(self) -> "openai.AsyncOpenAI":
+        """Client for chains that call OpenAI directly instead of through langchain,
+        with the same key, endpoint, timeout and retries as the llm. Created on first use.
+        """
+        import openai
+
+        return openai.AsyncOpenAI(
+            **openai_client_params(self.llm), http_client=self.http_client
+        )
+
+    async def aclose(self):
+        """Close the pooled connections of the llm clients"""
+        if "http_client" in self.__dict__:
+            await self.http_client.aclose()
+
+    def close(self):
+        run_sync(self.aclose())
+
+    # Formatted prompt inputs are cached, and reset whenever their source is updated
+    @property
+    def experiences(self) -> list:
+        return self._experiences
+
+    @experiences.setter
+    def experiences(self, experiences: list):
+        self._experiences = experiences
+        self.__dict__.pop("_experiences_str", None)
+
+    @property
+    def skills(self) -> list:
+        return self._skills
+
+    @skills.setter
+    def skills(self, skills: list):
+        self._skills = skills
+        self.__dict__.pop("_skills_str", None)
+
+    @property
+    def degrees(self) -> list:
+        return self._degrees
+
+    @degrees.setter
+    def degrees(self, degrees: list):
+        self._degrees = degrees
+        self.__dict__.pop("_degrees_str", None)
+
+    @property
+    def projects(self) -> list:
+        return self._projects
+
+    @projects.setter
+    def projects(self, projects: list):
+        self._projects = projects
+        self.__dict__.pop("_projects_str", None)
+
+    @cached_property
+    def _section_rewriter_prompt(self) -> ChatPromptTemplate:
         prompt_msgs = [
             SystemMessage(
                 content=(
@@ -296,30 +824,47 @@ class Resume_Builder:
                 )
             ),
             HumanMessage(content=("Let us begin...")),
-            HumanMessagePromptTemplate.from_template(
-                "Step 1: I am providing the job posting, which includes four sections about the job - <Duties>, <Experience requirements>, <Technical skills>, <Non-technical skills>. The entire job posting is enclosed in three backticks:"
-                "\n```\nJob Posting:"
-                "\n<Duties>\n{duties}\n"
-                "\n<Experience requirements>\n{skill_and_experience_requirements}\n"
-                "\n<Technical skills>\n{technical_skill_requirements}\n"
-                "\n<Non-technical skills>\n{soft_skill_requirements}\n"
-                "```"
+            HumanMessage(
+                content=(
+                    "Step 1: I am providing the job posting, which includes four sections about the job - <Duties>, <Experience requirements>, <Technical skills>, <Non-technical skills>. The entire job posting is enclosed in three backticks:"
+                    "\n```\nJob Posting:"
+                    "\n<Duties>\n{duties}\n"
+                    "\n<Experience requirements>\n{skill_and_experience_requirements}\n"
+                    "\n<Technical skills>\n{technical_skill_requirements}\n"
+                    "\n<Non-technical skills>\n{soft_skill_requirements}\n"
+                    "```"
+                ).format(**self.job_post.parsed_job_strings)
             ),
+            # the section is the only input, and is kept in the last message,
+            # so all preceding messages are a static prefix across sections
             HumanMessagePromptTemplate.from_template(
                 "Step 2: I am providing a section from my Resume as the input for you to rephrase. It is enclosed in four backticks:"
                 "\n````\nSection from my Resume:\n{section}\n````"
+                "\nYou must now complete the rest of the steps, starting at Step 3."
+                "\nTips: Make sure to answer in the correct format, match all listed criteria, and stick to any word or item limits."
             ),
-            HumanMessage(
-                content="You must now complete the rest of the steps, starting at Step 3."
+        ]
+        return ChatPromptTemplate(messages=prompt_msgs)
+
+    @cached_property
+    def _sections_rewriter_prompt(self) -> ChatPromptTemplate:
+        # shares the static prefix of the single section rewriter prompt
+        prompt_msgs = self._section_rewriter_prompt.messages[:-1] + [
+            HumanMessagePromptTemplate.from_template(
+                "Step 2: I am providing {count} numbered sections from my Resume as the input for you to rephrase. Each section is enclosed in four backticks:"
+                "{sections}"
+                "\nYou must now complete the rest of the steps, starting at Step 3, separately for each section. Output one list of bullet points for each section, in the same order as the sections."
                 "\nTips: Make sure to answer in the correct format, match all listed criteria, and stick to any word or item limits."
             ),
         ]
-        prompt = ChatPromptTemplate(messages=prompt_msgs)
+        return ChatPromptTemplate(messages=prompt_msgs)
 
-        llm = create_llm(**self.llm_kwargs)
-        return create_structured_output_chain(Resume_List, llm, prompt, **chain_kwargs)
+    @cached_property
+    def _section_prompt_cache_key(self) -> str:
+        return prompt_cache_key(self._section_rewriter_prompt)
 
-    def _skill_selector_chain(self, **chain_kwargs) -> LLMChain:
+    @cached_property
+    def _skill_selector_prompt(self) -> ChatPromptTemplate:
         prompt_msgs = [
             SystemMessage(
                 content=(
@@ -341,12 +886,14 @@ class Resume_Builder:
                 )
             ),
             HumanMessage(content=("Let us begin...")),
-            HumanMessagePromptTemplate.from_template(
-                "Step 1: I am providing the job posting, which includes two sections about the job - <Technical skills>, <Non-technical skills>. The entire job posting is enclosed in three backticks:"
-                "\n```\nJob Posting:"
-                "\n<Technical skills>\n{technical_skill_requirements}\n"
-                "\n<Non-technical skills>\n{soft_skill_requirements}\n"
-                "```"
+            HumanMessage(
+                content=(
+                    "Step 1: I am providing the job posting, which includes two sections about the job - <Technical skills>, <Non-technical skills>. The entire job posting is enclosed in three backticks:"
+                    "\n```\nJob Posting:"
+                    "\n<Technical skills>\n{technical_skill_requirements}\n"
+                    "\n<Non-technical skills>\n{soft_skill_requirements}\n"
+                    "```"
+                ).format(**self.job_post.parsed_job_strings)
             ),
             HumanMessagePromptTemplate.from_template(
                 "Step 2: I am providing my Resume, which includes two sections: <My Work Experience>, <My Projects>. My entire Resume is enclosed in four backticks:"
@@ -354,29 +901,28 @@ class Resume_Builder:
                 "\n<My Work Experience>\n{experiences}\n"
                 "\n<My Projects>\n{projects}\n"
                 "````"
-            ),
-            HumanMessage(
-                content="You must now complete the rest of the steps starting at Step 3, including any sub-steps."
+                "\nYou must now complete the rest of the steps starting at Step 3, including any sub-steps."
                 "\nTips: Make sure to answer in the correct format and  and stick to any word or item limits."
             ),
         ]
-        prompt = ChatPromptTemplate(messages=prompt_msgs)
+        return ChatPromptTemplate(messages=prompt_msgs)
 
-        llm = create_llm(**self.llm_kwargs)
-        return create_structured_output_chain(
-            Resume_Skills, llm, prompt, **chain_kwargs
+    def _skill_selector_chain(self, **chain_kwargs) -> LLMChain:
+        return create_structured_chain(
+            Resume_Skills, self.llm, self._skill_selector_prompt, **chain_kwargs
         )
 
-    def _improver_chain(self, **chain_kwargs) -> LLMChain:
+    @cached_property
+    def _improver_prompt(self) -> ChatPromptTemplate:
         prompt_msgs = [
             SystemMessage(
                 content=(
-                    "You are an expert Resume Reviewer proficient in making suggestions for improvements to a Resume. You strictly follow all the provided steps in order."
+                    "You are an expert Resume Reviewer proficient in making suggestions for improvements to a Resume, with advanced experience in proofreading, editing, spelling, grammar, proper sentence structure, and punctuation. You strictly follow all the provided steps in order."
                 )
             ),
             HumanMessage(
                 content=(
-                    "Your goal is to read and understand both a job posting and my Resume, identify the requirements from the job posting that are missing in my Resume, and finally make suggestions for improvements."
+                    "Your goal is to read and understand both a job posting and my Resume, identify the requirements from the job posting that are missing in my Resume, make suggestions for improvements, and identify any language errors in my Resume."
                 )
             ),
             HumanMessage(
@@ -384,18 +930,20 @@ class Resume_Builder:
                     "\nExecute all the steps internally. Generate output for only those steps that begin with <Final Answer>. The steps to follow are:"
                     "\nStep 1: I will give you a job posting."
                     "\nStep 2: Then I will give you my Resume."
-                    "\nStep 3: Identify a list of those requirements from the job posting that are NOT present in my Resume."
-                    "\nStep 4: For each missing requirement that you identified in Step 3, check again whether that requirement is in fact present in my Resume. Note that a requirement may be present in my Resume in a different phrasing than in the job posting. If the requirement is present in my Resume, remove it from your list of missing requirements."
-                    "\nStep 5: <Final Answer> Output the final list of suggestions from Step 4."
+                    "\nStep 3: <Final Answer> Identify a list of those requirements from the job posting that are NOT present in my Resume. Note that a requirement may be present in my Resume in a different phrasing than in the job posting."
+                    "\nStep 4: <Final Answer> Output a list of suggestions for improvements to my Resume based on the missing requirements from Step 3."
+                    "\nStep 5: <Final Answer> Find all grammatical, spelling, and punctuation errors in my Resume, and suggest a fix for each error. Limit the list to the first 20 errors."
                 )
             ),
             HumanMessage(content=("Let us begin...")),
-            HumanMessagePromptTemplate.from_template(
-                "Step 1: I am providing the job posting, which includes two sections about the job - <Duties>, <Experience requirements>. The entire job posting is enclosed in three backticks:"
-                "\n```\nJob Posting:"
-                "\n<Duties>\n{duties}\n"
-                "\n<Experience requirements>\n{skill_and_experience_requirements}\n"
-                "```"
+            HumanMessage(
+                content=(
+                    "Step 1: I am providing the job posting, which includes two sections about the job - <Duties>, <Experience requirements>. The entire job posting is enclosed in three backticks:"
+                    "\n```\nJob Posting:"
+                    "\n<Duties>\n{duties}\n"
+                    "\n<Experience requirements>\n{skill_and_experience_requirements}\n"
+                    "```"
+                ).format(**self.job_post.parsed_job_strings)
             ),
             HumanMessagePromptTemplate.from_template(
                 "Step 2: I am providing my Resume, which includes four sections - <My Education Degrees>, <My Work Experience>, <My Projects>, <My Skills>. My entire Resume is enclosed in four backticks:"
@@ -405,70 +953,105 @@ class Resume_Builder:
                 "\n<My Projects>\n{projects}\n"
                 "\n<My Skills>\n{skills}\n"
                 "````"
-            ),
-            HumanMessage(
-                content="You must now complete the rest of the steps starting at Step 3."
+                "\nYou must now complete the rest of the steps starting at Step 3."
                 "\nTips: Make sure to answer in the correct format, and stick to any word or item limits."
             ),
         ]
-        prompt = ChatPromptTemplate(messages=prompt_msgs)
+        return ChatPromptTemplate(messages=prompt_msgs)
 
-        llm = create_llm(**self.llm_kwargs)
-        return create_structured_output_chain(
-            Resume_Improvements, llm, prompt, **chain_kwargs
+    def _improver_chain(self, **chain_kwargs) -> LLMChain:
+        return create_structured_chain(
+            Resume_Improvements_Plus_Language,
+            self.llm,
+            self._improver_prompt,
+            **chain_kwargs,
         )
 
-    def _language_check_chain(self, **chain_kwargs) -> LLMChain:
+    @cached_property
+    def _summary_writer_prompt(self) -> ChatPromptTemplate:
         prompt_msgs = [
             SystemMessage(
                 content=(
-                    "You are an expert in English language arts with advanced experience in proofreading, editing, spelling, grammar, proper sentence structure, and punctuation."
+                    "You are an expert Resume Writer proficient in summarizing a resume based on a job posting. You strictly follow all the provided steps in order."
                 )
             ),
             HumanMessage(
                 content=(
-                    "Your goal is to carefully read the input to identify any grammatical or spelling errors. "
-                    "You will make appropriate suggestions to fix these errors. "
+                    "Your goal is to read and understand both a job posting and my Resume, and summarize my Resume according to the job posting."
                 )
             ),
+            HumanMessage(
+                content=(
+                    "\nWe will follow the following steps:"
+                    "\nStep 1: I will give you a job posting."
+                    "\nStep 2: Then I will give you my Resume."
+                    "\nStep 3: You must summarize my Resume from Step 2 into a short paragraph that highlights my accomplishments, relevant skills, experience, "
+                    "expertise, and other credentials that demonstrate how I am the most suitable candidate to apply for the job posting from Step 1. "
+                    "The Summary must not exceed 80 words. I am providing below some examples to familiarize you with the writing style:"
+                    "\nSummary Example:"
+                    "\nTechnical project manager with over seven years of experience managing both agile and waterfall projects for large technology organizations. "
+                    "Key strengths include budget management, contract and vendor relations, client-facing communications, stakeholder awareness, and cross-functional "
+                    "team management. Excellent leadership, organization, and communication skills, with special experience bridging large teams and providing process "
+                    "in the face of ambiguity."
+                )
+            ),
+            HumanMessage(content=("Let us begin...")),
+            HumanMessage(
+                content=(
+                    "Step 1: I am providing a summary of the job posting, enclosed in three backticks:"
+                    "\n```\nJob Posting: {job_summary}```"
+                ).format(**self.job_post.parsed_job_strings)
+            ),
             HumanMessagePromptTemplate.from_template(
-                "The input is my Resume, which includes four sections - Education, Experience, Projects, Skills. Find all errors and suggest improvements from the following input:"
+                "Step 2: I am providing my Resume, which includes four sections - <My Education Degrees>, <My Work Experience>, <My Projects>, <My Skills>. My entire Resume is enclosed in four backticks:"
                 "\n````\nMy Resume:"
-                "\nEducation\n{degrees}\n"
-                "\nExperience\n{experiences}\n"
-                "\nProjects\n{projects}\n"
-                "\nSkills\n{skills}\n"
+                "\n<My Education Degrees>\n{degrees}\n"
+                "\n<My Work Experience>\n{experiences}\n"
+                "\n<My Projects>\n{projects}\n"
+                "\n<My Skills>\n{skills}\n"
                 "````"
-            ),
-            HumanMessage(
-                content="Tips: Make sure to answer in the correct format. Limit the list to the first 20 errors."
+                "\nYou must now complete the rest of the steps starting at Step 3."
+                "\nTips: Make sure to answer in the correct format, and stick to any word or item limits."
             ),
         ]
-        prompt = ChatPromptTemplate(messages=prompt_msgs)
+        return ChatPromptTemplate(messages=prompt_msgs)
 
-        llm = create_llm(**self.llm_kwargs)
-        return create_structured_output_chain(
-            Language_Improvements, llm, prompt, **chain_kwargs
+    def _summary_writer_chain(self, **chain_kwargs) -> LLMChain:
+        return create_structured_chain(
+            Resume_Summary, self.llm, self._summary_writer_prompt, **chain_kwargs
         )
 
-    def _summary_writer_chain(self, **chain_kwargs) -> LLMChain:
+    @cached_property
+    def _full_resume_prompt(self) -> ChatPromptTemplate:
         prompt_msgs = [
             SystemMessage(
                 content=(
-                    "You are an expert Resume Writer proficient in summarizing a resume based on a job posting. You strictly follow all the provided steps in order."
+                    "You are an expert Resume Writer proficient in rephrasing text into key bullet points, extracting skills, and summarizing a resume based on a job posting. You strictly follow all the provided steps in order."
                 )
             ),
             HumanMessage(
                 content=(
-                    "Your goal is to read and understand both a job posting and my Resume, and summarize my Resume according to the job posting."
+                    "Your goal is to read and understand both a job posting and my Resume, rephrase my work experiences and projects into bullet points that demonstrate my expertise and relevance, extract my most relevant skills, and summarize my Resume according to the job posting."
                 )
             ),
             HumanMessage(
                 content=(
-                    "\nWe will follow the following steps:"
+                    "\nExecute all the steps internally. Generate output for only those steps that begin with <Final Answer>. The steps to follow are:"
                     "\nStep 1: I will give you a job posting."
                     "\nStep 2: Then I will give you my Resume."
-                    "\nStep 3: You must summarize my Resume from Step 2 into a short paragraph that highlights my accomplishments, relevant skills, experience, "
+                    "\nStep 3: Separately for each numbered work experience, and for my projects, you must condense and rephrase my Resume input from Step 2 into key bullet points that meet the following criteria:"
+                    "\n    - Each bullet point must be written to match my input with the duties, experience, and skill requirements mentioned in the job posting provided in Step 1."
+                    "\n    - Use action verbs. Give tangible and concrete examples, and include success metrics when available."
+                    "\n    - Find qualities such as leader, teamplayer, expert, etc. in the job posting. In each bullet point, incorporate some of these words that you found."
+                    "\n    - Each bullet point must must have more than 40 words and can include multiple sentences."
+                    "\n    - Grammar, spellings, and sentence structure must be correct."
+                    f"\n    - You must limit each work experience and my projects to no more than the most relevant {self.MAX_SECTION_ITEMS} bullet points."
+                    "\nStep 4: You must review and revise each bullet point to ensure all the above listed criteria are strictly met."
+                    "\nStep 5: You will rate the relevance of each bullet point to the job posting between 1 and 5."
+                    "\nStep 6: <Final Answer> Output the bullet points and their relevance from Steps 4 and 5."
+                    "\nStep 7: <Final Answer> Extract a list of Technical Skills from my Resume in Step 2 that match the skills in the job posting from Step 1."
+                    "\nStep 8: <Final Answer> Extract a list of non-technical Soft Skills from my Resume in Step 2 that match the non-technical soft skills in the job posting from Step 1. Limit this list to the 10 most relevant Soft Skills."
+                    "\nStep 9: <Final Answer> Summarize my Resume from Step 2 into a short paragraph that highlights my accomplishments, relevant skills, experience, "
                     "expertise, and other credentials that demonstrate how I am the most suitable candidate to apply for the job posting from Step 1. "
                     "The Summary must not exceed 80 words. I am providing below some examples to familiarize you with the writing style:"
                     "\nSummary Example:"
@@ -479,194 +1062,527 @@ class Resume_Builder:
                 )
             ),
             HumanMessage(content=("Let us begin...")),
-            HumanMessagePromptTemplate.from_template(
-                "Step 1: I am providing a summary of the job posting, enclosed in three backticks:"
-                "\n```\nJob Posting: {job_summary}```"
+            HumanMessage(
+                content=(
+                    "Step 1: I am providing the job posting, which includes five sections about the job - <Summary>, <Duties>, <Experience requirements>, <Technical skills>, <Non-technical skills>. The entire job posting is enclosed in three backticks:"
+                    "\n```\nJob Posting:"
+                    "\n<Summary>\n{job_summary}\n"
+                    "\n<Duties>\n{duties}\n"
+                    "\n<Experience requirements>\n{skill_and_experience_requirements}\n"
+                    "\n<Technical skills>\n{technical_skill_requirements}\n"
+                    "\n<Non-technical skills>\n{soft_skill_requirements}\n"
+                    "```"
+                ).format(**self.job_post.parsed_job_strings)
             ),
             HumanMessagePromptTemplate.from_template(
-                "Step 2: I am providing my Resume, which includes four sections - <My Education Degrees>, <My Work Experience>, <My Projects>, <My Skills>. My entire Resume is enclosed in four backticks:"
+                "Step 2: I am providing my Resume, which includes three sections - <My Education Degrees>, <My Work Experience>, <My Projects>. Only the numbered work experiences are to be rephrased, the others are final but still part of my Resume. My entire Resume is enclosed in four backticks:"
                 "\n````\nMy Resume:"
                 "\n<My Education Degrees>\n{degrees}\n"
                 "\n<My Work Experience>\n{experiences}\n"
                 "\n<My Projects>\n{projects}\n"
-                "\n<My Skills>\n{skills}\n"
                 "````"
-            ),
-            HumanMessage(
-                content="You must now complete the rest of the steps starting at Step 3."
-                "\nTips: Make sure to answer in the correct format, and stick to any word or item limits."
+                "\nYou must now complete the rest of the steps starting at Step 3."
+                "\nTips: Make sure to answer in the correct format, match all listed criteria, and stick to any word or item limits."
             ),
         ]
-        prompt = ChatPromptTemplate(messages=prompt_msgs)
-
-        llm = create_llm(**self.llm_kwargs)
-        return create_structured_output_chain(
-            Resume_Summary, llm, prompt, **chain_kwargs
-        )
+        return ChatPromptTemplate(messages=prompt_msgs)
 
     def _get_degrees(self, resume: dict):
-        result = []
-        for degrees in utils.generator_key_in_nested_dict("degrees", resume):
-            for degree in degrees:
-                if isinstance(degree["names"], list):
-                    result.extend(degree["names"])
-                elif isinstance(degree["names"], str):
-                    result.append(degree["names"])
-        return result
+        names = (
+            degree["names"]
+            for degrees in utils.generator_key_in_nested_dict("degrees", resume)
+            for degree in degrees
+        )
+        return list(
+            itertools.chain.from_iterable(
+                n if isinstance(n, list) else (n,)
+                for n in names
+                if isinstance(n, (list, str))
+            )
+        )
 
     def _format_skills_for_prompt(self, skills: list) -> list:
         result = []
         for cat in skills:
-            curr = ""
+            parts = []
             if cat.get("category", ""):
-                curr += f"{cat['category']}: "
+                parts.append(f"{cat['category']}: ")
             if "skills" in cat:
-                curr += "Proficient in "
-                curr += ", ".join(cat["skills"])
-                result.append(curr)
+                parts.append("Proficient in ")
+                parts.append(", ".join(cat["skills"]))
+                result.append("".join(parts))
         return result
 
     def _get_cumulative_time_from_titles(self, titles) -> int:
-        result = 0.0
-        for t in titles:
-            if "startdate" in t and "enddate" in t:
-                if t["enddate"] == "current":
-                    last_date = date.today().strftime("%Y-%m-%d")
-                else:
-                    last_date = t["enddate"]
-            result += datediff_years(start_date=t["startdate"], end_date=last_date)
-        return round(result)
-
-    def _format_experiences_for_prompt(self) -> list:
-        result = []
-        for exp in self.experiences:
-            curr = ""
-            if "titles" in exp:
-                exp_time = self._get_cumulative_time_from_titles(exp["titles"])
-                curr += f"{exp_time} years experience in:\n"
-            if "highlights" in exp:
-                curr += format_list_as_string(exp["highlights"])
-                curr += "\n"
-                result.append(curr)
-        return result
+        # normalized string keeps the parse_date cache key stable within a day
+        today = date.today().isoformat()
+        # sum whole months as integers, and convert to years once
+        months = sum(
+            _complete_months(
+                parse_date(t["startdate"]),
+                parse_date(today if t["enddate"] == "current" else t["enddate"]),
+            )
+            for t in titles
+            if "startdate" in t and "enddate" in t
+        )
+        return round(months / 12.0)
+
+    @cached_property
+    def _skills_str(self) -> str:
+        return format_list_as_string(self._format_skills_for_prompt(self.skills))
+
+    @cached_property
+    def _degrees_str(self) -> str:
+        return format_list_as_string(self.degrees)
+
+    @cached_property
+    def _projects_str(self) -> str:
+        return format_list_as_string(self.projects)
+
+    @cached_property
+    def _experiences_str(self) -> str:
+        # experiences without highlights are not included in the prompt
+        return format_list_as_string(
+            [
+                self._format_experience_for_prompt(exp, exp["highlights"])
+                for exp in self.experiences
+                if "highlights" in exp
+            ]
+        )
+
+    def _format_experience_for_prompt(self, exp: dict, text: list | str) -> str:
+        parts = []
+        if "titles" in exp:
+            exp_time = self._get_cumulative_time_from_titles(exp["titles"])
+            parts.append(f"{exp_time} years experience in:\n")
+        parts.append(format_list_as_string(text))
+        parts.append("\n")
+        return "".join(parts)
 
     def _combine_skills_in_category(self, l1: list[str], l2: list[str]):
         """Combines l2 into l1 without lowercase duplicates"""
         # get lowercase items
         l1_lower = {i.lower() for i in l1}
         for i in l2:
-            if i.lower() not in l1_lower:
+            i_lower = i.lower()
+            if i_lower not in l1_lower:
                 l1.append(i)
+                l1_lower.add(i_lower)
 
     def _combine_skill_lists(self, l1: list[dict], l2: list[dict]):
         """Combine l2 skills list into l1 without duplicating lowercase category or skills"""
-        l1_categories_lowercase = {s["category"].lower(): i for i, s in enumerate(l1)}
+        l1_categories_lowercase = {s["category"].lower(): s for s in l1}
         for s in l2:
-            if s["category"].lower() in l1_categories_lowercase:
+            category_lower = s["category"].lower()
+            if category_lower in l1_categories_lowercase:
                 self._combine_skills_in_category(
-                    l1[l1_categories_lowercase[s["category"].lower()]]["skills"],
-                    s["skills"],
+                    l1_categories_lowercase[category_lower]["skills"], s["skills"]
                 )
             else:
+                # copy, so later categories are not merged into the raw skills
+                s = dict(s, skills=list(s["skills"]))
                 l1.append(s)
+                l1_categories_lowercase[category_lower] = s
+
+    async def _astream_direct_structured_call(
+        self,
+        messages: list[dict],
+        schema_cls: type[msgspec.Struct],
+        prompt_cache_key: str = None,
+    ) -> AsyncIterator[str]:
+        """Stream the JSON reply of an OpenAI chat completion constrained to the msgspec class"""
+        stream = await self.openai_client.chat.completions.create(
+            model=self.llm.model_name,
+            temperature=self.llm.temperature,
+            messages=messages,
+            response_format=_json_schema_response_format(schema_cls),
+            stream=True,
+            # routes requests with the same static prefix to the same prompt cache
+            extra_body=(
+                {"prompt_cache_key": prompt_cache_key} if prompt_cache_key else None
+            ),
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    async def _astream_chain_structured_call(
+        self,
+        prompt: ChatPromptTemplate,
+        prompt_inputs: dict,
+        schema_cls: type[msgspec.Struct],
+    ) -> AsyncIterator[str]:
+        """Fallback for llms without OpenAI structured outputs, that requests the reply through a langchain structured output chain.
+        The complete reply is yielded at once as JSON."""
+        chain = create_structured_chain(
+            _object_json_schema(schema_cls), self.llm, prompt
+        )
+        yield json.dumps(await chain.apredict(**prompt_inputs))
 
-    def rewrite_section(self, section: list | str, **chain_kwargs) -> dict:
-        chain = self._section_rewriter_chain(**chain_kwargs)
-        chain_inputs = format_prompt_inputs_as_strings(
-            prompt_inputs=chain.prompt.input_variables,
-            **self.job_post.parsed_job,
-            section=section,
+    async def _astream_cached_structured_call(
+        self,
+        prompt: ChatPromptTemplate,
+        prompt_inputs: dict,
+        schema_cls: type[msgspec.Struct],
+        prompt_cache_key: str = None,
+        validate: Callable = None,
+    ) -> AsyncIterator[str]:
+        """Stream the JSON reply to the prompt constrained to the msgspec class, replayed from the response cache if the same request was answered before.
+        A new reply is cached once it is complete, decodes as the msgspec class, and passes `validate`.
+        """
+        key = _response_cache_key(
+            prompt.format(**prompt_inputs), msgspec.json.schema(schema_cls), self.llm
         )
-        section_revised = chain.predict(**chain_inputs).dict()
+        cached = get_response_cache().get(key)
+        if cached is not None:
+            yield cached
+            return
+
+        if supports_structured_outputs(self.llm):
+            messages = [
+                _message_to_openai(m) for m in prompt.format_messages(**prompt_inputs)
+            ]
+            stream = self._astream_direct_structured_call(
+                messages, schema_cls, prompt_cache_key=prompt_cache_key
+            )
+        else:
+            stream = self._astream_chain_structured_call(
+                prompt, prompt_inputs, schema_cls
+            )
+        content = []
+        async for text in stream:
+            content.append(text)
+            yield text
+        content = "".join(content)
+        reply = msgspec.json.decode(content, type=schema_cls)
+        if validate is None or validate(reply):
+            get_response_cache().set(key, content)
+
+    async def _acached_structured_call(
+        self,
+        prompt: ChatPromptTemplate,
+        prompt_inputs: dict,
+        schema_cls: type[msgspec.Struct],
+        prompt_cache_key: str = None,
+        validate: Callable = None,
+    ) -> msgspec.Struct | None:
+        """Complete reply of `_astream_cached_structured_call` decoded as the msgspec class, or None if it fails `validate`"""
+        content = "".join(
+            [
+                text
+                async for text in self._astream_cached_structured_call(
+                    prompt, prompt_inputs, schema_cls, prompt_cache_key, validate
+                )
+            ]
+        )
+        reply = msgspec.json.decode(content, type=schema_cls)
+        if validate is not None and not validate(reply):
+            return None
+        return reply
+
+    async def astream_section(
+        self, section: list | str, **chain_kwargs
+    ) -> AsyncIterator[Resume_Item]:
+        """Rewrite a section, yielding each bullet point as soon as the llm has generated it.
+        The section is requested directly from OpenAI, or through a fallback chain, so `chain_kwargs` are not used.
+        """
+        import ijson
+
+        prompt = self._section_rewriter_prompt
+        # the job posting is already part of the prompt, so the section is the only input
+        prompt_inputs = dict(section=format_list_as_string(section))
+
+        # incrementally parse the streamed reply into bullet points
+        parsed_items = ijson.sendable_list()
+        parser = ijson.items_coro(parsed_items, "items.item")
+        async for text in self._astream_cached_structured_call(
+            prompt,
+            prompt_inputs,
+            Resume_List,
+            prompt_cache_key=self._section_prompt_cache_key,
+        ):
+            parser.send(text.encode())
+            for parsed_item in parsed_items:
+                yield msgspec.convert(parsed_item, type=Resume_Item)
+            del parsed_items[:]
+        parser.close()
+
+    def _sort_section_items(self, section_revised: list[Resume_Item]) -> list[str]:
         # sort section based on relevance in descending order
-        section_revised = sorted(
-            section_revised["items"], key=lambda d: d["relevance"] * -1
+        section_revised = sorted(section_revised, key=lambda d: d.relevance * -1)
+        return [s.item for s in section_revised]
+
+    async def arewrite_section(self, section: list | str, **chain_kwargs) -> list:
+        section_revised = [
+            item async for item in self.astream_section(section, **chain_kwargs)
+        ]
+        return self._sort_section_items(section_revised)
+
+    async def arewrite_sections(
+        self, sections: list[list | str], **chain_kwargs
+    ) -> list[list]:
+        """Rewrite several sections in a single llm call, to share its network and prefill cost"""
+        if len(sections) == 1:
+            return [await self.arewrite_section(sections[0], **chain_kwargs)]
+
+        prompt = self._sections_rewriter_prompt
+        prompt_inputs = dict(
+            count=str(len(sections)),
+            sections="".join(
+                f"\n````\nSection {i} from my Resume:\n{format_list_as_string(section)}\n````"
+                for i, section in enumerate(sections, start=1)
+            ),
+        )
+        reply = await self._acached_structured_call(
+            prompt,
+            prompt_inputs,
+            Resume_Sections,
+            prompt_cache_key=self._section_prompt_cache_key,
+            validate=lambda reply: len(reply.sections) == len(sections),
         )
-        return [s["item"] for s in section_revised]
+        if reply is None:
+            logger.warning(
+                f"Expected {len(sections)} rewritten sections, but received a different number. Rewriting each section separately."
+            )
+            return list(
+                await asyncio.gather(
+                    *(self.arewrite_section(s, **chain_kwargs) for s in sections)
+                )
+            )
+        return [self._sort_section_items(s.items) for s in reply.sections]
+
+    def rewrite_section(self, section: list | str, **chain_kwargs) -> list:
+        return run_sync(self.arewrite_section(section=section, **chain_kwargs))
 
-    def rewrite_unedited_experiences(self, **chain_kwargs) -> dict:
+    def _split_unedited_experiences(self) -> tuple[list, list[tuple[dict, str]]]:
+        """Experiences without their unedited text, and the (experience, unedited text) pairs to rewrite"""
         result = []
+        rewrites = []
         for exp_raw in self.experiences_raw:
-            # create copy of raw experience to update
-            exp = dict(exp_raw)
-            experience_unedited = exp.pop("unedited", None)
-            if experience_unedited:
+            if "unedited" not in exp_raw:
+                # nothing to rewrite, so reuse the raw experience without copying
+                result.append(exp_raw)
+                continue
+            # create copy of raw experience without the unedited text to update
+            exp = {k: v for k, v in exp_raw.items() if k != "unedited"}
+            if exp_raw["unedited"]:
                 # rewrite experience using llm
-                exp["highlights"] = self.rewrite_section(
-                    section=experience_unedited, **chain_kwargs
-                )
+                rewrites.append((exp, exp_raw["unedited"]))
             result.append(exp)
-
+        return result, rewrites
+
+    async def arewrite_unedited_experiences(
+        self, max_concurrency: int = 5, **chain_kwargs
+    ) -> list:
+        # limit the number of simultaneous llm calls to respect rate limits
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def rewrite(sections):
+            async with semaphore:
+                return await self.arewrite_sections(sections, **chain_kwargs)
+
+        result, rewrites = self._split_unedited_experiences()
+        # rewrite experiences in batches of rows, one llm call per batch
+        batches = [
+            rewrites[i : i + self.BATCH_ROWS]
+            for i in range(0, len(rewrites), self.BATCH_ROWS)
+        ]
+        highlights = await asyncio.gather(
+            *(rewrite([unedited for _, unedited in batch]) for batch in batches)
+        )
+        for batch, batch_highlights in zip(batches, highlights):
+            for (exp, _), exp_highlights in zip(batch, batch_highlights):
+                exp["highlights"] = exp_highlights
         return result
 
-    def extract_skills(self, **chain_kwargs) -> dict:
+    def rewrite_unedited_experiences(
+        self, max_concurrency: int = 5, **chain_kwargs
+    ) -> list:
+        return run_sync(
+            self.arewrite_unedited_experiences(
+                max_concurrency=max_concurrency, **chain_kwargs
+            )
+        )
+
+    async def aextract_skills(self, **chain_kwargs) -> list:
         chain = self._skill_selector_chain(**chain_kwargs)
-        chain_inputs = format_prompt_inputs_as_strings(
-            prompt_inputs=chain.prompt.input_variables,
-            **self.job_post.parsed_job,
-            degrees=self.degrees,
-            experiences=self._format_experiences_for_prompt(),
-            skills=self._format_skills_for_prompt(self.skills_raw),
-            projects=self.projects,
+        chain_inputs = self._resume_inputs(chain.prompt.input_variables)
+
+        extracted_skills = await acached_predict(chain, Resume_Skills, **chain_inputs)
+        return self._combine_extracted_skills(
+            extracted_skills.software_skills, extracted_skills.soft_skills
         )
 
-        extracted_skills = chain.predict(**chain_inputs).dict()
-        result = []
-        if "software_skills" in extracted_skills:
-            result.append(
-                dict(category="Technical", skills=extracted_skills["software_skills"])
-            )
-        if "soft_skills" in extracted_skills:
-            result.append(
-                dict(category="Non-technical", skills=extracted_skills["soft_skills"])
-            )
+    def _combine_extracted_skills(
+        self, software_skills: list[str], soft_skills: list[str]
+    ) -> list:
+        result = [
+            dict(category="Technical", skills=software_skills),
+            dict(category="Non-technical", skills=soft_skills),
+        ]
         # Add skills from raw file
         self._combine_skill_lists(result, self.skills_raw)
         return result
 
-    def suggest_improvements(self, **chain_kwargs) -> dict:
-        chain = self._improver_chain(**chain_kwargs)
-        chain_inputs = format_prompt_inputs_as_strings(
-            prompt_inputs=chain.prompt.input_variables,
-            **self.job_post.parsed_job,
-            degrees=self.degrees,
-            projects=self.projects,
-            experiences=self._format_experiences_for_prompt(),
-            skills=self._format_skills_for_prompt(self.skills),
-        )
-        improvements = chain.predict(**chain_inputs).dict()["improvements"]
+    def extract_skills(self, **chain_kwargs) -> list:
+        return run_sync(self.aextract_skills(**chain_kwargs))
 
-        chain = self._language_check_chain(**chain_kwargs)
-        chain_inputs = format_prompt_inputs_as_strings(
-            prompt_inputs=chain.prompt.input_variables,
-            **self.job_post.parsed_job,
-            degrees=self.degrees,
-            projects=self.projects,
-            experiences=self._format_experiences_for_prompt(),
-            skills=self._format_skills_for_prompt(self.skills),
-        )
-        language_fixes = chain.predict(**chain_inputs).dict()
-        language_fixes = [
-            f"{fix['error']} -> {fix['fix']}" for fix in language_fixes["fixes"]
-        ]
+    def _resume_inputs(self, prompt_inputs: list[str]) -> dict:
+        """Resume sections formatted once and reused by every chain. The job posting is already part of the prompts."""
+        # only the sections in the prompt are formatted, since the others may not be generated yet
+        return {k: getattr(self, f"_{k}_str") for k in prompt_inputs}
+
+    def _improvements_request(
+        self, **chain_kwargs
+    ) -> tuple[LLMChain, type[BaseModel], dict]:
+        chain = self._improver_chain(**chain_kwargs)
+        chain_inputs = self._resume_inputs(chain.prompt.input_variables)
+        return chain, Resume_Improvements_Plus_Language, chain_inputs
+
+    def _combine_improvements(
+        self, suggestions: Resume_Improvements_Plus_Language
+    ) -> list:
+        improvements = list(suggestions.improvements)
+        # nothing to add for a resume without language errors
+        if not suggestions.fixes:
+            return improvements
+        language_fixes = list(map("{0.error} -> {0.fix}".format, suggestions.fixes))
         improvements.append({"Language improvements": language_fixes})
 
         return improvements
 
-    def create_summary(self, **chain_kwargs) -> dict:
-        chain = self._summary_writer_chain(**chain_kwargs)
-        chain_inputs = format_prompt_inputs_as_strings(
-            prompt_inputs=chain.prompt.input_variables,
-            **self.job_post.parsed_job,
-            degrees=self.degrees,
-            projects=self.projects,
-            experiences=self._format_experiences_for_prompt(),
-            skills=self._format_skills_for_prompt(self.skills),
+    async def asuggest_improvements(self, **chain_kwargs) -> list:
+        chain, schema, chain_inputs = self._improvements_request(**chain_kwargs)
+        suggestions = await acached_predict(chain, schema, **chain_inputs)
+        return self._combine_improvements(suggestions)
+
+    def suggest_improvements(self, **chain_kwargs) -> list:
+        return run_sync(self.asuggest_improvements(**chain_kwargs))
+
+    def suggest_improvements_batch(
+        self, poll_interval: float = 60.0, **chain_kwargs
+    ) -> Openai_Batch:
+        """Submit the improvement chain to the OpenAI Batch API at half the cost.
+        Await the returned batch to get the same output as `suggest_improvements`."""
+        return Openai_Batch(
+            [self._improvements_request(**chain_kwargs)],
+            postprocess=self._combine_improvements,
+            poll_interval=poll_interval,
         )
 
-        return chain.predict(**chain_inputs).dict()["summary"]
+    async def acreate_summary(self, **chain_kwargs) -> str:
+        chain = self._summary_writer_chain(**chain_kwargs)
+        chain_inputs = self._resume_inputs(chain.prompt.input_variables)
+
+        summary = await acached_predict(chain, Resume_Summary, **chain_inputs)
+        return summary.summary
+
+    def create_summary(self, **chain_kwargs) -> str:
+        return run_sync(self.acreate_summary(**chain_kwargs))
+
+    async def agenerate_full_resume(self) -> bool:
+        """Generate experiences, projects, skills and summary in a single llm call, so the job posting and resume are sent once.
+        Returns False without setting any section if the reply does not match the resume.
+        """
+        result, rewrites = self._split_unedited_experiences()
+        # the whole work history is sent, but only the experiences to rewrite are numbered
+        unedited = {id(exp): text for exp, text in rewrites}
+        experiences = []
+        numbered = 0
+        for exp in result:
+            if id(exp) in unedited:
+                numbered += 1
+                experiences.append(
+                    f"<Work Experience {numbered}>\n"
+                    + self._format_experience_for_prompt(exp, unedited[id(exp)])
+                )
+            elif "highlights" in exp:
+                experiences.append(
+                    self._format_experience_for_prompt(exp, exp["highlights"])
+                )
+        prompt = self._full_resume_prompt
+        prompt_inputs = dict(
+            degrees=self._degrees_str,
+            experiences=format_list_as_string(experiences),
+            projects=format_list_as_string(self.projects_raw),
+        )
+        full_resume = await self._acached_structured_call(
+            prompt,
+            prompt_inputs,
+            Full_Resume,
+            prompt_cache_key=prompt_cache_key(prompt),
+            validate=lambda reply: len(reply.experiences) == len(rewrites),
+        )
+        if full_resume is None:
+            logger.warning(
+                f"Expected {len(rewrites)} rewritten experiences, but received a different number. Generating each section separately."
+            )
+            return False
+
+        for (exp, _), exp_highlights in zip(rewrites, full_resume.experiences):
+            exp["highlights"] = self._sort_section_items(exp_highlights.items)
+        self.experiences = result
+        if self.projects_raw:
+            self.projects = self._sort_section_items(full_resume.projects.items)
+        self.skills = self._combine_extracted_skills(
+            full_resume.software_skills, full_resume.soft_skills
+        )
+        self.summary = full_resume.summary
+        return True
+
+    async def astream_finalize(
+        self, fused: bool = True, **chain_kwargs
+    ) -> AsyncIterator[tuple[str, list | str]]:
+        """Generate the sections that have not been set yet, yielding the name and content of each section as soon as it is complete.
+        On a cold start, all sections are generated by one fused llm call unless `fused` is False.
+        Otherwise, sections are generated concurrently wherever they don't depend on each other.
+        """
+        cold_start = all(
+            section is None
+            for section in (self.experiences, self.projects, self.skills, self.summary)
+        )
+        if fused and cold_start and await self.agenerate_full_resume():
+            yield "experiences", self.experiences
+            if self.projects is not None:
+                yield "projects", self.projects
+            yield "skills", self.skills
+            yield "summary", self.summary
+            return
+
+        async def generate(name, coro):
+            return name, await coro
+
+        pending = []
+        if self.experiences is None:
+            pending.append(
+                generate(
+                    "experiences", self.arewrite_unedited_experiences(**chain_kwargs)
+                )
+            )
+        if self.projects is None and self.projects_raw:
+            pending.append(
+                generate(
+                    "projects",
+                    self.arewrite_section(section=self.projects_raw, **chain_kwargs),
+                )
+            )
+        for next_section in asyncio.as_completed(pending):
+            name, section = await next_section
+            setattr(self, name, section)
+            yield name, section
+        # skills are extracted from experiences and projects, and the summary needs all of them
+        if self.skills is None:
+            self.skills = await self.aextract_skills(**chain_kwargs)
+            yield "skills", self.skills
+        if self.summary is None:
+            self.summary = await self.acreate_summary(**chain_kwargs)
+            yield "summary", self.summary
+
+    async def afinalize(self, fused: bool = True, **chain_kwargs) -> dict:
+        """Generate the sections that have not been set yet, and combine all sections into the final resume"""
+        async for _ in self.astream_finalize(fused=fused, **chain_kwargs):
+            pass
 
-    def finalize(self) -> dict:
         return dict(
             basic=self.basic_info,
             summary=self.summary,
@@ -675,3 +1591,6 @@ class Resume_Builder:
             experiences=self.experiences,
             skills=self.skills,
         )
+
+    def finalize(self, fused: bool = True, **chain_kwargs) -> dict:
+        return run_sync(self.afinalize(fused=fused, **chain_kwargs))